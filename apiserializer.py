@@ -1,5 +1,6 @@
 import json
 import logging
+import os
 import typing
 
 import openapi
@@ -78,37 +79,92 @@ def member(value, *, definition_id=None, navigate_to_id=None) -> typing.List[Tok
     ]
 
 
-def path_definition_id(path: openapi.Path) -> str:
+def path_definition_id(
+    path: openapi.Path, document_label: typing.Optional[str] = None
+) -> str:
+    if document_label:
+        return f"path:{document_label}:{path.name}"
     return f"path:{path.name}"
 
 
-def model_definition_id(definition: typing.Union[str, openapi.Definition]) -> str:
+def operation_definition_id(
+    operation: openapi.Operation, document_label: typing.Optional[str] = None
+) -> str:
+    if document_label:
+        return f"{document_label}:{operation.name}"
+    return operation.name
+
+
+def document_definition_id(document_label: str) -> str:
+    return f"file:{document_label}"
+
+
+def model_definition_id(
+    definition: typing.Union[str, openapi.Definition], variant: int = 0
+) -> str:
     if isinstance(definition, str):
-        return f"definition:{definition}"
+        definition_id = f"definition:{definition}"
     else:
-        return f"definition:{definition.typename}"
+        definition_id = f"definition:{definition.typename}"
+    if variant:
+        definition_id += f"@{variant}"
+    return definition_id
 
 
 class ApiViewNavigationEncoder:
-    def serialize(self, document: openapi.Document):
+    def serialize(
+        self, document: typing.Union[openapi.Document, openapi.DocumentSet]
+    ):
+        if isinstance(document, openapi.DocumentSet):
+            title = os.path.commonpath(
+                [member.file_path for member in document.documents]
+            )
+            paths = [
+                {
+                    "Text": label,
+                    "NavigationId": document_definition_id(label),
+                    "ChildItems": [
+                        {
+                            "Text": path.name,
+                            "NavigationId": path_definition_id(path, label),
+                            "ChildItems": [],
+                            "Tags": {"TypeKind": "unknown"},
+                        }
+                        for path in member.paths
+                    ],
+                    "Tags": {"TypeKind": "unknown"},
+                }
+                for label, member in zip(document.labels, document.documents)
+            ]
+
+            def definition_id(definition):
+                return model_definition_id(
+                    definition, document.definition_variant(definition)
+                )
+
+        else:
+            title = document.file_path
+            paths = [
+                {
+                    "Text": path.name,
+                    "NavigationId": path_definition_id(path),
+                    "ChildItems": [],
+                    "Tags": {"TypeKind": "unknown"},
+                }
+                for path in document.paths
+            ]
+            definition_id = model_definition_id
+
         return [
             {
-                "Text": document.file_path,
+                "Text": title,
                 "NavigationId": None,
                 "ChildItems": [
                     {
                         "Text": "Paths",
                         "NavigationId": None,
                         "DefinitionId": None,
-                        "ChildItems": [
-                            {
-                                "Text": path.name,
-                                "NavigationId": path_definition_id(path),
-                                "ChildItems": [],
-                                "Tags": {"TypeKind": "unknown"},
-                            }
-                            for path in document.paths
-                        ],
+                        "ChildItems": paths,
                         "Tags": {"TypeKind": "unknown"},
                     },
                     {
@@ -118,7 +174,7 @@ class ApiViewNavigationEncoder:
                         "ChildItems": [
                             {
                                 "Text": definition.typename,
-                                "NavigationId": model_definition_id(definition),
+                                "NavigationId": definition_id(definition),
                                 "ChildItems": [],
                                 "Tags": {"TypeKind": "unknown"},
                             }
@@ -133,7 +189,7 @@ class ApiViewNavigationEncoder:
                         "ChildItems": [
                             {
                                 "Text": definition.typename,
-                                "NavigationId": model_definition_id(definition),
+                                "NavigationId": definition_id(definition),
                                 "ChildItems": [],
                                 "Tags": {"TypeKind": "unknown"},
                             }
@@ -148,6 +204,41 @@ class ApiViewNavigationEncoder:
 
 
 class ApiViewTokenEncoder:
+
+    # Documents with fewer segments (paths and definitions) than this are always
+    # serialized in-process - starting worker processes would cost more than it saves.
+    DEFAULT_PARALLEL_THRESHOLD = 2000
+
+    def __init__(
+        self,
+        *,
+        jobs: typing.Optional[int] = None,
+        parallel_threshold: int = DEFAULT_PARALLEL_THRESHOLD,
+    ):
+        """
+        :param jobs: Number of worker processes to serialize paths and definitions
+            in. None or 1 serializes in-process.
+        :param parallel_threshold: Minimum number of paths and definitions in a
+            document before worker processes are used.
+        """
+        self.jobs = jobs
+        self.parallel_threshold = parallel_threshold
+        self._property_shapes: typing.Dict[tuple, int] = {}
+        self._property_tokens: typing.Dict[
+            typing.Tuple[int, int], typing.List[TokenDict]
+        ] = {}
+        self._documentset: typing.Optional[openapi.DocumentSet] = None
+
+    def _model_navigation_id(
+        self, document: openapi.Document, modeltypename: str
+    ) -> str:
+        """NavigateToId for a reference to the model modeltypename in document"""
+        if self._documentset is None:
+            return model_definition_id(modeltypename)
+        return model_definition_id(
+            modeltypename, self._documentset.typename_variant(document, modeltypename)
+        )
+
     def serialize_operation_parameters(
         self, operation: openapi.Operation
     ) -> typing.List[TokenDict]:
@@ -170,8 +261,8 @@ class ApiViewTokenEncoder:
                 + whitespace()
                 + typename(
                     operation.body_parameter.typename,
-                    navigate_to_id=model_definition_id(
-                        operation.body_parameter.typename
+                    navigate_to_id=self._model_navigation_id(
+                        operation.document, operation.body_parameter.typename
                     ),
                 )
             )
@@ -195,6 +286,9 @@ class ApiViewTokenEncoder:
         return tokens
 
     def serialize_operation(self, operation: openapi.Operation):
+        document_label = (
+            self._documentset.label(operation.document) if self._documentset else None
+        )
         tokens = (
             whitespace(2)
             + keyword(operation.verb)
@@ -204,7 +298,10 @@ class ApiViewTokenEncoder:
                 definition_id=operation.return_value.typename,
             )
             + whitespace()
-            + member(operation.name, definition_id=operation.name)
+            + member(
+                operation.name,
+                definition_id=operation_definition_id(operation, document_label),
+            )
             + punctuation("(")
             + self.serialize_operation_parameters(operation)
             + punctuation(")")
@@ -212,23 +309,38 @@ class ApiViewTokenEncoder:
         )
         return tokens
 
-    def serialize_path(self, pathinstance: openapi.Path) -> typing.List[TokenDict]:
+    def serialize_path(
+        self, pathinstance: openapi.Path, *, definition_id: typing.Optional[str] = None
+    ) -> typing.List[TokenDict]:
         tokens = (
-            text(pathinstance.name, definition_id=path_definition_id(pathinstance))
+            text(
+                pathinstance.name,
+                definition_id=definition_id or path_definition_id(pathinstance),
+            )
             + newline()
         )
         for operation in pathinstance.operations:
             tokens += self.serialize_operation(operation)
         return tokens
 
-    def _recurse_serialize_definition(
-        self, modelproperty: "ModelProperty", *, depth=1
+    def _property_navigation_id(
+        self, modelproperty: "ModelProperty"
+    ) -> typing.Optional[str]:
+        if modelproperty.typetype != "model":
+            return None
+        return self._model_navigation_id(
+            modelproperty.document,
+            modelproperty.itemtypename or modelproperty.typename,
+        )
+
+    def _serialize_property_line(
+        self, modelproperty: "ModelProperty", depth: int
     ) -> typing.List[TokenDict]:
-        tokens = []
         propertytypename = modelproperty.itemtypename or modelproperty.typename
         if modelproperty.typetype == "model":
             propertytypetoken = typename(
-                propertytypename, navigate_to_id=model_definition_id(propertytypename)
+                propertytypename,
+                navigate_to_id=self._property_navigation_id(modelproperty),
             )
         else:
             propertytypetoken = keyword(propertytypename)
@@ -236,26 +348,78 @@ class ApiViewTokenEncoder:
         if modelproperty.itemtypename:
             propertytypetoken = punctuation("[") + propertytypetoken + punctuation("]")
 
-        tokens += (
+        return (
             whitespace(4 * depth)
             + propertytypetoken
             + whitespace(1)
             + member(modelproperty.name)
             + newline()
         )
-        for childproperty in modelproperty.properties:
-            tokens += self._recurse_serialize_definition(childproperty, depth=depth + 1)
 
-        return tokens
+    def _serialize_property_tree(
+        self, modelproperty: "ModelProperty", *, depth=1
+    ) -> typing.List[TokenDict]:
+        """Serialize a property and its nested inline properties.
+
+        Token output for a subtree is cached by its shape (everything that affects
+        the output) and indentation, so structurally identical inline schemas are
+        only serialized once.
+        """
+        # Post-order walk: children are serialized (and assigned a shape) before
+        # their parent, which can then be looked up in the cache as a whole.
+        results: typing.Dict[int, typing.Tuple[int, typing.List[TokenDict]]] = {}
+        stack = [(modelproperty, depth, False)]
+        while stack:
+            current, currentdepth, visited = stack.pop()
+            if not visited:
+                stack.append((current, currentdepth, True))
+                for childproperty in current.properties:
+                    stack.append((childproperty, currentdepth + 1, False))
+                continue
+
+            children = [results.pop(id(child)) for child in current.properties]
+            shapekey = (
+                current.name,
+                current.typename,
+                current.itemtypename,
+                current.typetype,
+                current.elided,
+                self._property_navigation_id(current),
+                tuple(childshape for childshape, _ in children),
+            )
+            shape = self._property_shapes.setdefault(
+                shapekey, len(self._property_shapes)
+            )
+            try:
+                tokens = self._property_tokens[(shape, currentdepth)]
+            except KeyError:
+                tokens = self._serialize_property_line(current, currentdepth)
+                for _, childtokens in children:
+                    tokens += childtokens
+                if current.elided:
+                    tokens += (
+                        whitespace(4 * (currentdepth + 1))
+                        + punctuation("...")
+                        + newline()
+                    )
+                self._property_tokens[(shape, currentdepth)] = tokens
+            results[id(current)] = (shape, tokens)
+
+        return list(results[id(modelproperty)][1])
 
     def serialize_definition(
-        self, resource_or_support: str, definition: openapi.Definition
+        self,
+        resource_or_support: str,
+        definition: openapi.Definition,
+        *,
+        definition_id: typing.Optional[str] = None,
     ) -> typing.List[TokenDict]:
         tokens = (
             keyword(resource_or_support)
             + whitespace()
             + typename(
-                definition.typename, definition_id=model_definition_id(definition)
+                definition.typename,
+                definition_id=definition_id or model_definition_id(definition),
             )
         )
         bases: typing.List[TokenDict] = []
@@ -263,48 +427,170 @@ class ApiViewTokenEncoder:
             if not bases:
                 bases += punctuation("(")
             bases += typename(
-                base.typename, navigate_to_id=model_definition_id(base.typename)
+                base.typename,
+                navigate_to_id=self._model_navigation_id(
+                    definition.document, base.typename
+                ),
             )
         if bases:
             tokens = tokens + bases + punctuation(")")
         tokens = tokens + newline()
         for modelproperty in definition.properties:
-            tokens += self._recurse_serialize_definition(modelproperty)
+            tokens += self._serialize_property_tree(modelproperty)
         return tokens
 
+    def _segments(
+        self, document: typing.Union[openapi.Document, openapi.DocumentSet]
+    ) -> typing.List[typing.Tuple[str, typing.Any, typing.Optional[str]]]:
+        """The independently serializable parts of the document (or document set)
+        as (kind, element, definition id) in output order
+        """
+        segments: typing.List[typing.Tuple[str, typing.Any, typing.Optional[str]]]
+        if isinstance(document, openapi.DocumentSet):
+            segments = []
+            for label, member in zip(document.labels, document.documents):
+                segments.append(("document", label, document_definition_id(label)))
+                segments += [
+                    ("path", pathinstance, path_definition_id(pathinstance, label))
+                    for pathinstance in member.paths
+                ]
+
+            def definition_id(definition):
+                return model_definition_id(
+                    definition, document.definition_variant(definition)
+                )
+
+        else:
+            segments = [("path", pathinstance, None) for pathinstance in document.paths]
+
+            def definition_id(definition):
+                return None
+
+        if segments:
+            segments.append(("separator", None, None))
+        segments += [
+            ("ResourceModel", definition, definition_id(definition))
+            for definition in document.resourcedefinitions
+        ]
+        segments += [
+            ("InnerModel", definition, definition_id(definition))
+            for definition in document.supportdefinitions
+        ]
+        return segments
+
+    def _serialize_segment(
+        self, kind: str, element, definition_id: typing.Optional[str]
+    ) -> typing.List[TokenDict]:
+        if kind == "path":
+            return self.serialize_path(element, definition_id=definition_id)
+        elif kind == "document":
+            return text(element, definition_id=definition_id) + newline()
+        elif kind == "separator":
+            return newline() + newline()
+        else:
+            return self.serialize_definition(
+                kind, element, definition_id=definition_id
+            )
+
+    def _prepare(
+        self, document: typing.Union[openapi.Document, openapi.DocumentSet]
+    ) -> typing.List[typing.Tuple[str, typing.Any, typing.Optional[str]]]:
+        """Reset the state kept per document and return its segments"""
+        self._property_shapes.clear()
+        self._property_tokens.clear()
+        self._documentset = (
+            document if isinstance(document, openapi.DocumentSet) else None
+        )
+        return self._segments(document)
+
     def serialize(self, document):
+        segments = self._prepare(document)
+
+        jobs = self.jobs or 1
+        if jobs > 1 and len(segments) >= self.parallel_threshold:
+            return self._serialize_parallel(document, len(segments), jobs)
+
         tokens = []
-        for pathinstance in document.paths:
-            tokens += self.serialize_path(pathinstance)
-        if tokens:
-            tokens += newline() + newline()
-        for definition in document.resourcedefinitions:
-            tokens += self.serialize_definition("ResourceModel", definition)
-        for definition in document.supportdefinitions:
-            tokens += self.serialize_definition("InnerModel", definition)
+        for kind, element, definition_id in segments:
+            tokens += self._serialize_segment(kind, element, definition_id)
+        return tokens
 
+    def _serialize_parallel(
+        self,
+        document: typing.Union[openapi.Document, openapi.DocumentSet],
+        segmentcount: int,
+        jobs: int,
+    ) -> typing.List[TokenDict]:
+        import concurrent.futures
+
+        # A few chunks per worker keeps the workers evenly loaded without paying
+        # the inter-process overhead for every single segment.
+        chunksize = max(1, -(-segmentcount // (jobs * 4)))
+        chunks = [
+            (start, min(start + chunksize, segmentcount))
+            for start in range(0, segmentcount, chunksize)
+        ]
+        tokens: typing.List[TokenDict] = []
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=_initialize_serialization_worker,
+            initargs=(document, self.__class__),
+        ) as executor:
+            # map() yields results in submission order, so the output is the
+            # same as for the serial loop.
+            for chunktokens in executor.map(_serialize_segment_range, chunks):
+                tokens += chunktokens
         return tokens
 
 
+_worker_encoder: typing.Optional[ApiViewTokenEncoder] = None
+_worker_segments: typing.List[typing.Tuple[str, typing.Any, typing.Optional[str]]] = []
+
+
+def _initialize_serialization_worker(
+    document: typing.Union[openapi.Document, openapi.DocumentSet],
+    encoder_class: typing.Type[ApiViewTokenEncoder],
+):
+    global _worker_encoder, _worker_segments
+    _worker_encoder = encoder_class()
+    _worker_segments = _worker_encoder._prepare(document)
+
+
+def _serialize_segment_range(
+    chunk: typing.Tuple[int, int]
+) -> typing.List[TokenDict]:
+    assert _worker_encoder is not None
+    start, end = chunk
+    tokens: typing.List[TokenDict] = []
+    for kind, element, definition_id in _worker_segments[start:end]:
+        tokens += _worker_encoder._serialize_segment(kind, element, definition_id)
+    return tokens
+
+
 class ApiViewEncoder(json.JSONEncoder):
     def __init__(
         self,
         *,
         navigation_encoder=ApiViewNavigationEncoder(),
         token_encoder=ApiViewTokenEncoder(),
+        include_diagnostics=False,
         **kwargs,
     ):
         super().__init__(**kwargs)
 
         self.navigation_encoder = navigation_encoder
         self.token_encoder = token_encoder
+        self.include_diagnostics = include_diagnostics
 
     def default(self, o):
-        if isinstance(o, openapi.Document):
-            return {
+        if isinstance(o, (openapi.Document, openapi.DocumentSet)):
+            out = {
                 "Navigation": self.navigation_encoder.serialize(document=o),
                 "Tokens": list(self.token_encoder.serialize(document=o)),
             }
+            if self.include_diagnostics:
+                out["Diagnostics"] = o.diagnostics.report()
+            return out
         else:
             return json.JSONEncoder.default(self, o)
 
@@ -312,16 +598,111 @@ class ApiViewEncoder(json.JSONEncoder):
 def cli():
     import argparse
 
+    import snapshot
+
     parser = argparse.ArgumentParser("apiserializer")
-    parser.add_argument(type=str, dest="filename")
+    parser.add_argument(type=str, dest="filenames", nargs="*")
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        dest="manifest",
+        default=None,
+        help="AutoRest style readme.md listing the files to combine into one view",
+    )
+    parser.add_argument(
+        "--tag",
+        type=str,
+        dest="tag",
+        default=None,
+        help="Tag in the --manifest to take the files from (default: its default tag)",
+    )
     parser.add_argument("--debug", action="store_true", dest="debug", default=False)
+    parser.add_argument(
+        "--max-property-depth",
+        type=int,
+        dest="max_property_depth",
+        default=openapi.Document.DEFAULT_MAX_PROPERTY_DEPTH,
+    )
+    parser.add_argument(
+        "--snapshot-dir",
+        type=str,
+        dest="snapshot_dir",
+        default=None,
+        help="Directory to load built documents from and save them to",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        dest="jobs",
+        default=1,
+        help="Number of processes to serialize with (0 for one per CPU)",
+    )
+    parser.add_argument(
+        "--parallel-threshold",
+        type=int,
+        dest="parallel_threshold",
+        default=ApiViewTokenEncoder.DEFAULT_PARALLEL_THRESHOLD,
+        help="Minimum number of paths and definitions before using --jobs",
+    )
+    parser.add_argument(
+        "--inline-diagnostics",
+        action="store_true",
+        dest="inline_diagnostics",
+        default=False,
+        help="Include the diagnostics report in the output",
+    )
+    parser.add_argument(
+        "--diagnostics-file",
+        type=str,
+        dest="diagnostics_file",
+        default=None,
+        help="Write the diagnostics report to this file instead of standard error",
+    )
     args = parser.parse_args()
 
+    filenames = list(args.filenames)
+    if args.manifest:
+        filenames += openapi.load_manifest(args.manifest, args.tag)
+    if not filenames:
+        parser.error("no files to analyze")
+
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARN)
-    doc = openapi.Document(args.filename)
-    out = json.dumps(doc, cls=ApiViewEncoder, indent=2)
+    if len(filenames) == 1:
+        doc = snapshot.load_or_build(
+            filenames[0],
+            args.snapshot_dir,
+            max_property_depth=args.max_property_depth,
+        )
+    elif args.snapshot_dir:
+        doc = openapi.DocumentSet(
+            [
+                snapshot.load_or_build(
+                    filename,
+                    args.snapshot_dir,
+                    max_property_depth=args.max_property_depth,
+                )
+                for filename in filenames
+            ]
+        )
+    else:
+        doc = openapi.DocumentSet.from_files(
+            filenames, max_property_depth=args.max_property_depth
+        )
+    token_encoder = ApiViewTokenEncoder(
+        jobs=args.jobs or os.cpu_count(), parallel_threshold=args.parallel_threshold
+    )
+    out = json.dumps(
+        doc,
+        cls=ApiViewEncoder,
+        indent=2,
+        token_encoder=token_encoder,
+        include_diagnostics=args.inline_diagnostics,
+    )
     print(out)
 
+    if not args.inline_diagnostics:
+        openapi.write_diagnostics(doc.diagnostics, args.diagnostics_file)
+
 
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,131 @@
+"""Bundle an openapi document and everything it references into a single file.
+
+Every fragment that is referenced from another file is copied into the root
+document under #/x-bundled/{file}/{pointer}, where {file} is the path of the
+file relative to the root document, and every $ref is rewritten to point to
+the copy. Each target is copied once, no matter how many times (or from which
+files) it is referenced.
+
+The original location of each copy is recorded in #/x-bundle-provenance, which
+openapi.Document uses to keep reporting the original names.
+"""
+import copy
+import json
+import logging
+import os.path
+import typing
+
+import openapi
+
+logger = logging.getLogger(__name__)
+
+BUNDLED_KEY = "x-bundled"
+PROVENANCE_KEY = "x-bundle-provenance"
+
+
+def _relative_path(root_file_path: str, file_path: str) -> str:
+    return os.path.relpath(file_path, os.path.dirname(root_file_path)).replace(
+        os.sep, "/"
+    )
+
+
+def bundle(file_path: str) -> openapi.JsonFragment:
+    """Return the document in file_path with all external references pulled in
+    """
+    root_file_path = os.path.normpath(os.path.abspath(file_path))
+    files: typing.Dict[str, typing.Any] = {}
+
+    def load_file(path):
+        try:
+            return files[path]
+        except KeyError:
+            pass
+        with open(path, mode="r", encoding="utf8") as f:
+            files[path] = json.load(f)
+        return files[path]
+
+    root = load_file(root_file_path)
+    bundled: typing.Dict[str, typing.Any] = {}
+    provenance: typing.Dict[str, str] = {}
+    placed: typing.Dict[typing.Tuple[str, str], str] = {}
+
+    # (file the fragment came from, fragment) - references in a fragment are
+    # relative to the file it came from, not to the root document.
+    stack: typing.List[typing.Tuple[str, typing.Any]] = [(root_file_path, root)]
+    while stack:
+        owner_file_path, node = stack.pop()
+        if isinstance(node, list):
+            stack.extend((owner_file_path, item) for item in node)
+            continue
+        if not isinstance(node, dict):
+            continue
+
+        ref = node.get("$ref")
+        if isinstance(ref, str):
+            target_file_path, localjsonpointer = openapi.split_reference(
+                owner_file_path, ref
+            )
+            if target_file_path == root_file_path:
+                node["$ref"] = f"#/{localjsonpointer}"
+            else:
+                key = (target_file_path, localjsonpointer)
+                if key not in placed:
+                    target = load_file(target_file_path)
+                    for part in localjsonpointer.split("/"):
+                        if part:
+                            target = target[openapi.unescape_jsonpointer(part)]
+                    target = copy.deepcopy(target)
+
+                    relative_path = _relative_path(root_file_path, target_file_path)
+                    parts = [relative_path] + [
+                        openapi.unescape_jsonpointer(part)
+                        for part in localjsonpointer.split("/")
+                        if part
+                    ]
+                    container = bundled
+                    for part in parts[:-1]:
+                        container = container.setdefault(part, {})
+                    container[parts[-1]] = target
+
+                    jsonpointer = f"#/{BUNDLED_KEY}/" + "/".join(
+                        openapi.escape_jsonpointer(part) for part in parts
+                    )
+                    placed[key] = jsonpointer
+                    provenance[jsonpointer] = f"{relative_path}#/{localjsonpointer}"
+                    stack.append((target_file_path, target))
+                node["$ref"] = placed[key]
+
+        stack.extend(
+            (owner_file_path, value) for name, value in node.items() if name != "$ref"
+        )
+
+    if bundled:
+        root[BUNDLED_KEY] = bundled
+        root[PROVENANCE_KEY] = provenance
+    logger.debug(
+        "Bundled %d fragments from %d files", len(placed), len(files) - 1
+    )
+    return root
+
+
+def cli():
+    import argparse
+
+    parser = argparse.ArgumentParser("bundle")
+    parser.add_argument(type=str, dest="filename")
+    parser.add_argument("-o", "--output", type=str, dest="output", default=None)
+    parser.add_argument("--debug", action="store_true", dest="debug", default=False)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARN)
+
+    out = json.dumps(bundle(args.filename), indent=2)
+    if args.output:
+        with open(args.output, mode="w", encoding="utf8") as f:
+            f.write(out)
+    else:
+        print(out)
+
+
+if __name__ == "__main__":
+    cli()
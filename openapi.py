@@ -1,7 +1,11 @@
 import collections
+import collections.abc
+import hashlib
 import json
 import logging
 import os.path
+import re
+import sys
 import typing
 
 logger = logging.getLogger(__name__)
@@ -9,6 +13,8 @@ logger = logging.getLogger(__name__)
 
 JsonFragment = typing.Dict[str, typing.Any]
 
+HTTP_VERBS = ("get", "put", "post", "delete", "options", "head", "patch")
+
 
 class _OpenApiElement:
     def __init__(
@@ -19,14 +25,59 @@ class _OpenApiElement:
         self.raw_jsonfragment = jsonfragment
         self.jsonfragment = self.resolve(jsonfragment)
 
-    def resolve(self, jsonfragment) -> JsonFragment:
-        resolved = jsonfragment.copy()
+    def resolve(self, jsonfragment) -> typing.Mapping[str, typing.Any]:
+        return self.document.resolve_fragment(jsonfragment, keep_ref=False)
+
+
+class ResolvedFragment(collections.abc.Mapping):
+    """Read-only view of a json fragment merged with the target of its $ref.
+
+    Keys of the $ref target take precedence over the keys of the fragment itself,
+    and keys are iterated in the same order as the dict you get by copying the
+    fragment and then updating it with the target. The "$ref" key of the fragment
+    itself is only visible if keep_ref is set.
+    """
+
+    __slots__ = ("_local", "_target", "_keep_ref")
+
+    def __init__(
+        self,
+        local: typing.Mapping[str, typing.Any],
+        target: typing.Mapping[str, typing.Any],
+        *,
+        keep_ref: bool,
+    ):
+        self._local = local
+        self._target = target
+        self._keep_ref = keep_ref
+
+    def __getitem__(self, key):
         try:
-            ref = resolved.pop("$ref")
-            resolved.update(self.document.load_fragment(ref))
+            return self._target[key]
         except KeyError:
             pass
-        return resolved
+        if key == "$ref" and not self._keep_ref:
+            raise KeyError(key)
+        return self._local[key]
+
+    def __contains__(self, key):
+        return key in self._target or (
+            key in self._local and (key != "$ref" or self._keep_ref)
+        )
+
+    def __iter__(self):
+        for key in self._local:
+            if key != "$ref" or self._keep_ref:
+                yield key
+        for key in self._target:
+            if key not in self._local or (key == "$ref" and not self._keep_ref):
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({dict(self)!r})"
 
 
 class Schema(_OpenApiElement):
@@ -40,14 +91,20 @@ class Schema(_OpenApiElement):
     @property
     def typename(self):
         try:
-            return self.raw_jsonfragment["$ref"].split("/")[-1]
+            return self.document.reference_typename(self.raw_jsonfragment["$ref"])
         except KeyError:
             pass
         if (
             self.raw_jsonfragment.get("type", "") == "array"
             and "items" in self.raw_jsonfragment
         ):
-            return "[" + self.raw_jsonfragment["items"]["$ref"].split("/")[-1] + "]"
+            return (
+                "["
+                + self.document.reference_typename(
+                    self.raw_jsonfragment["items"]["$ref"]
+                )
+                + "]"
+            )
         else:
             return "?"
 
@@ -126,9 +183,19 @@ class ModelProperty(_OpenApiElement):
         jsonpointer: str,
         name: str,
         jsonfragment: JsonFragment,
+        *,
+        depth: int = 1,
+        nested: bool = True,
     ):
+        """
+        :param depth: Nesting depth of the property, 1 for properties of a definition.
+        :param nested: Whether to build the nested inline properties. Only the top
+            level property builds them, for its whole subtree.
+        """
         super().__init__(document, jsonpointer, jsonfragment)
         self.name = name
+        self.depth = depth
+        self.elided = False
         self.typename = self.type_information(self.raw_jsonfragment)
         if self.typename == "array":
             self.itemtypename = self.type_information(self.jsonfragment["items"])
@@ -140,19 +207,46 @@ class ModelProperty(_OpenApiElement):
         else:
             self.typetype = "model"
 
-        self.properties = [
-            ModelProperty(
-                document,
-                jsonpointer=self.jsonpointer + "/properties/" + name,
-                name=name,
-                jsonfragment=fragment,
-            )
-            for name, fragment in self.raw_jsonfragment.get("properties", {}).items()
-        ]
+        self.properties: typing.List["ModelProperty"] = []
+        if not nested:
+            return
+
+        # Nested inline properties are built with an explicit stack rather than by
+        # recursing through the constructor, so that deeply nested inline schemas
+        # cannot exhaust the interpreter stack. Anything nested deeper than the
+        # document's max_property_depth is dropped and the parent marked as elided.
+        stack = [self]
+        while stack:
+            parent = stack.pop()
+            nestedfragments = parent.raw_jsonfragment.get("properties", {})
+            if not nestedfragments:
+                continue
+            if parent.depth >= document.max_property_depth:
+                parent.elided = True
+                for childname in nestedfragments:
+                    document.diagnostics.info(
+                        "elided-property",
+                        parent.jsonpointer + "/properties/" + childname,
+                        "Property '%s' is nested deeper than %d levels and was elided",
+                        childname,
+                        document.max_property_depth,
+                    )
+                continue
+            for childname, fragment in nestedfragments.items():
+                child = ModelProperty(
+                    document,
+                    jsonpointer=parent.jsonpointer + "/properties/" + childname,
+                    name=childname,
+                    jsonfragment=fragment,
+                    depth=parent.depth + 1,
+                    nested=False,
+                )
+                parent.properties.append(child)
+                stack.append(child)
 
     def type_information(self, raw_jsonfragment):
         if "$ref" in raw_jsonfragment:
-            return raw_jsonfragment["$ref"].split("/")[-1]
+            return self.document.reference_typename(raw_jsonfragment["$ref"])
         jsonfragment = self.document.resolve_fragment(raw_jsonfragment)
         if "type" in jsonfragment:
             return jsonfragment["type"]
@@ -175,7 +269,7 @@ class Definition(_OpenApiElement):
                 document=document,
                 jsonpointer=base["$ref"],
                 jsonfragment=self.resolve(base),
-                name=base["$ref"].split("/")[-1],
+                name=document.reference_typename(base["$ref"]),
             )
             for base in jsonfragment.get("allOf", {})
             if "$ref" in base
@@ -183,17 +277,22 @@ class Definition(_OpenApiElement):
 
         # In the degenerate case where you have an allOf with an inline definition, we merge it with the current
         # json fragment
-        for inline in jsonfragment.get("allOf", {}):
+        for index, inline in enumerate(jsonfragment.get("allOf", {})):
             if "$ref" not in inline:
-                logger.warn(
-                    f'Inline "allOf" definition for model {name}. This is an odd construct. Doing my best!'
+                document.diagnostics.warning(
+                    "inline-allof",
+                    jsonpointer + f"/allOf/{index}",
+                    'Inline "allOf" definition for model %s. This is an odd construct. Doing my best!',
+                    name,
                 )
-                self.jsonfragment.update(inline)
+                # The resolved fragment is a read-only view (or the raw fragment
+                # itself), so merge into a copy.
+                self.jsonfragment = {**self.jsonfragment, **inline}
 
         self.properties = [
             ModelProperty(
                 document=document,
-                jsonpointer=jsonpointer + "/properties" + name,
+                jsonpointer=jsonpointer + "/properties/" + name,
                 name=name,
                 jsonfragment=fragment,
             )
@@ -201,6 +300,44 @@ class Definition(_OpenApiElement):
         ]
 
 
+def _parse_parameters(
+    document: "Document", jsonpointer: str, parameterjsonfragments
+) -> typing.List[typing.Tuple[str, _OpenApiElement]]:
+    """Resolve each parameter once and wrap it in the element for its location,
+    returning (location, parameter) pairs in declaration order.
+    """
+    parameters: typing.List[typing.Tuple[str, _OpenApiElement]] = []
+    for index, parameterjsonfragment in enumerate(parameterjsonfragments):
+        parameterjsonpointer = jsonpointer + f"/parameters/{index}"
+        location = document.resolve_fragment(parameterjsonfragment).get("in", "")
+        if location == "body":
+            parameters.append(
+                (
+                    location,
+                    BodyParameter(
+                        document, parameterjsonpointer, parameterjsonfragment
+                    ),
+                )
+            )
+        elif location in ("query", "header", "path"):
+            parameters.append(
+                (
+                    location,
+                    QueryHeaderParameter(
+                        document, parameterjsonpointer, parameterjsonfragment
+                    ),
+                )
+            )
+    return parameters
+
+
+def _parameter_key(location: str, parameter: _OpenApiElement):
+    # There can only be one body parameter, whatever it is called
+    if location == "body":
+        return (location, None)
+    return (location, parameter.jsonfragment.get("name"))
+
+
 class Operation(_OpenApiElement):
     def __init__(
         self,
@@ -208,60 +345,40 @@ class Operation(_OpenApiElement):
         jsonpointer: str,
         verb: str,
         jsonfragment: typing.Dict[str, typing.Any],
+        *,
+        inherited_parameters: typing.Sequence[
+            typing.Tuple[str, _OpenApiElement]
+        ] = (),
     ):
         super().__init__(document, jsonpointer, jsonfragment)
         self.verb = verb.upper()
 
-        parameterjsonfragments = [
-            fragment for fragment in self.jsonfragment.get("parameters", [])
-        ]
-
-        # Extract the body parameter. There is exactly zero or one body parameters...
-        try:
-            index, bodyparameterjsonfragment = next(
-                enumerate(
-                    [
-                        parameterjsonfragment
-                        for parameterjsonfragment in parameterjsonfragments
-                        if document.resolve_fragment(parameterjsonfragment).get(
-                            "in", ""
-                        )
-                        == "body"
-                    ]
-                )
-            )
-            self.body_parameter: typing.Optional[BodyParameter] = BodyParameter(
-                document,
-                jsonpointer=jsonpointer + f"[{index}]",
-                jsonfragment=bodyparameterjsonfragment,
-            )
-        except StopIteration:
-            self.body_parameter = None
-
-        # Extract query parameters...
+        # Parameters declared on the operation override the parameters shared by
+        # all operations on the path (same name and location). The shared ones were
+        # resolved once by the Path and are reused as-is.
+        parameters = _parse_parameters(
+            document, jsonpointer, self.jsonfragment.get("parameters", [])
+        )
+        overridden = {_parameter_key(location, p) for location, p in parameters}
+        parameters = [
+            (location, parameter)
+            for location, parameter in inherited_parameters
+            if _parameter_key(location, parameter) not in overridden
+        ] + parameters
+
+        # There is exactly zero or one body parameters...
+        self.body_parameter: typing.Optional[BodyParameter] = next(
+            (parameter for location, parameter in parameters if location == "body"),
+            None,
+        )
         self.query_parameters = [
-            QueryHeaderParameter(
-                document, jsonpointer="unknown", jsonfragment=parameterjsonfragment
-            )
-            for parameterjsonfragment in parameterjsonfragments
-            if document.resolve_fragment(parameterjsonfragment).get("in", "") == "query"
+            parameter for location, parameter in parameters if location == "query"
         ]
-
         self.header_parameters = [
-            QueryHeaderParameter(
-                document, jsonpointer="unknown", jsonfragment=parameterjsonfragment
-            )
-            for parameterjsonfragment in parameterjsonfragments
-            if document.resolve_fragment(parameterjsonfragment).get("in", "")
-            == "header"
+            parameter for location, parameter in parameters if location == "header"
         ]
-
         self.path_parameters = [
-            QueryHeaderParameter(
-                document, jsonpointer="unknown", jsonfragment=parameterjsonfragment
-            )
-            for parameterjsonfragment in parameterjsonfragments
-            if document.resolve_fragment(parameterjsonfragment).get("in", "") == "path"
+            parameter for location, parameter in parameters if location == "path"
         ]
 
         return_values = [
@@ -295,7 +412,12 @@ class Operation(_OpenApiElement):
                 )
                 > 1
             ):
-                logger.warn("Multiple return types for operation '%s'", self.name)
+                document.diagnostics.warning(
+                    "multiple-return-types",
+                    jsonpointer,
+                    "Multiple return types for operation '%s'",
+                    self.name,
+                )
             self.return_value: typing.Union[Response, VoidResponse] = success_responses[
                 0
             ]
@@ -312,7 +434,12 @@ class Operation(_OpenApiElement):
                 len(set([val.typename for val in exceptions if val.typename != "void"]))
                 > 1
             ):
-                logger.warn("Multiple exception types for operation '%s'", self.name)
+                document.diagnostics.warning(
+                    "multiple-exception-types",
+                    jsonpointer,
+                    "Multiple exception types for operation '%s'",
+                    self.name,
+                )
             self.exceptions: typing.List[Response] = exceptions
         else:
             self.exceptions = []
@@ -333,21 +460,125 @@ class Path(_OpenApiElement):
         super().__init__(document, jsonpointer, jsonfragment)
         self.name = name
 
+        # Parameters shared by all operations on the path
+        self.parameters = _parse_parameters(
+            document, jsonpointer, self.jsonfragment.get("parameters", [])
+        )
+
+        # Everything else in a path item that is not an operation (parameters,
+        # extensions) is skipped.
         self.operations = [
             Operation(
                 document,
                 jsonpointer=jsonpointer + f"/{verb}",
                 verb=verb,
                 jsonfragment=fragment,
+                inherited_parameters=self.parameters,
             )
             for verb, fragment in self.jsonfragment.items()
+            if verb in HTTP_VERBS
+        ]
+
+
+class Diagnostic(typing.NamedTuple):
+    severity: str
+    code: str
+    file_path: str
+    jsonpointer: str
+    message: str
+    args: tuple
+
+
+class Diagnostics:
+    """Findings about a document, collected while it is built.
+
+    Recording is cheap: messages are %-style templates that are only formatted when
+    the report is produced, and repeated findings (same code at the same location)
+    are only counted.
+    """
+
+    ERROR = "error"
+    WARNING = "warning"
+    INFO = "info"
+
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+        self._entries: typing.Dict[typing.Tuple[str, str, str], typing.List] = {}
+
+    def add(self, severity: str, code: str, jsonpointer: str, message: str, *args):
+        key = (code, self.file_path, jsonpointer)
+        entry = self._entries.get(key)
+        if entry is None:
+            self._entries[key] = [
+                Diagnostic(severity, code, self.file_path, jsonpointer, message, args),
+                1,
+            ]
+        else:
+            entry[1] += 1
+
+    def error(self, code: str, jsonpointer: str, message: str, *args):
+        self.add(self.ERROR, code, jsonpointer, message, *args)
+
+    def warning(self, code: str, jsonpointer: str, message: str, *args):
+        self.add(self.WARNING, code, jsonpointer, message, *args)
+
+    def info(self, code: str, jsonpointer: str, message: str, *args):
+        self.add(self.INFO, code, jsonpointer, message, *args)
+
+    def extend(self, other: "Diagnostics"):
+        for key, (diagnostic, count) in other._entries.items():
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = [diagnostic, count]
+            else:
+                entry[1] += count
+
+    def __iter__(self) -> typing.Iterator[Diagnostic]:
+        return (diagnostic for diagnostic, _ in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def report(self) -> typing.List[typing.Dict[str, typing.Any]]:
+        return [
+            {
+                "Severity": diagnostic.severity,
+                "Code": diagnostic.code,
+                "File": diagnostic.file_path,
+                "JsonPointer": diagnostic.jsonpointer,
+                "Message": diagnostic.message % diagnostic.args,
+                "Count": count,
+            }
+            for diagnostic, count in self._entries.values()
         ]
 
 
 class Document:
-    def __init__(self, file_path):
+
+    # Inline properties nested deeper than this are elided from the model
+    DEFAULT_MAX_PROPERTY_DEPTH = 32
+
+    def __init__(
+        self,
+        file_path,
+        *,
+        max_property_depth=DEFAULT_MAX_PROPERTY_DEPTH,
+        files: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    ):
+        """
+        :param files: Cache of parsed files, keyed by absolute path. Pass the same
+            dictionary to several documents to parse the files they share only once.
+        """
         self.file_path = os.path.abspath(file_path)
+        self.max_property_depth = max_property_depth
+        self.diagnostics = Diagnostics(self.file_path)
+        self._files: typing.Dict[str, typing.Any] = {} if files is None else files
+        self._fragments: typing.Dict[str, typing.Any] = {}
+        self._resolved: typing.Dict[str, ResolvedFragment] = {}
         self.jsonfragment = self.load_fragment("#/")
+        self.provenance: typing.Dict[str, str] = self.jsonfragment.get(
+            "x-bundle-provenance", {}
+        )
         self.paths = sorted(
             [
                 Path(
@@ -374,7 +605,7 @@ class Document:
         self.refcounts = self._build_ref_counts()
 
     def _build_ref_counts(self):
-        refcounts = collections.defaultdict(lambda: set())
+        refcounts = collections.defaultdict(set)
         for definition in self.definitions:
             for prop in definition.properties:
                 normalized_typename = prop.itemtypename or prop.typename
@@ -460,42 +691,398 @@ class Document:
         ]
 
     def resolve_fragment(
-        self, fragment: typing.Dict[str, typing.Any]
-    ) -> typing.Dict[str, typing.Any]:
-        resolved = fragment.copy()
-        ref = resolved.get("$ref", None)
-        if ref:
-            resolved.update(self.load_fragment(ref))
-        return resolved
+        self, fragment: typing.Mapping[str, typing.Any], *, keep_ref: bool = True
+    ) -> typing.Mapping[str, typing.Any]:
+        """The fragment merged with the target of its $ref, if any.
 
-    def load_fragment(self, jsonpointer: str) -> typing.Dict[str, typing.Any]:
-        filepathjsonpointer, localjsonpointer = jsonpointer.split("#/", maxsplit=2)
+        Nothing is copied: fragments without a $ref are returned as-is, and the
+        (read-only) views for fragments that consist of just a $ref are cached per
+        json pointer. The result must not be modified.
+        """
+        ref = fragment.get("$ref", None)
+        if not ref:
+            if keep_ref or "$ref" not in fragment:
+                return fragment
+            return ResolvedFragment(fragment, {}, keep_ref=False)
 
-        if filepathjsonpointer in (".", "", "./"):
-            file_path = self.file_path
-        elif not os.path.isabs(filepathjsonpointer):
-            file_path = os.path.join(
-                os.path.dirname(self.file_path), filepathjsonpointer
+        try:
+            target = self.load_fragment(ref)
+        except KeyError:
+            if keep_ref:
+                raise
+            # Unresolvable references have always been dropped silently here
+            return ResolvedFragment(fragment, {}, keep_ref=False)
+
+        if len(fragment) > 1:
+            return ResolvedFragment(fragment, target, keep_ref=keep_ref)
+        if not keep_ref:
+            # A lone $ref resolves to exactly its target
+            return target
+        resolved = self._resolved.get(ref)
+        if resolved is None:
+            resolved = self._resolved[ref] = ResolvedFragment(
+                fragment, target, keep_ref=True
             )
-        else:
-            file_path = filepathjsonpointer
+        return resolved
+
+    @property
+    def source_files(self) -> typing.List[str]:
+        """Absolute paths of all files that have been read to build this document
+        """
+        return sorted(self._files)
 
+    def _load_file(self, file_path: str) -> typing.Any:
+        document = self._files.get(file_path)
+        if document is not None:
+            return document
         with open(file_path, mode="r", encoding="utf8") as f:
             document = json.load(f)
+        self._files[file_path] = document
+        return document
+
+    def __getstate__(self):
+        # Parsed files are only a cache for load_fragment (the fragments that the
+        # model refers to are kept alive by the elements themselves), so only the
+        # file names are kept when pickling.
+        state = self.__dict__.copy()
+        state["_files"] = dict.fromkeys(self._files)
+        state["_fragments"] = {}
+        state["_resolved"] = {}
+        return state
+
+    def original_reference(self, ref: str) -> str:
+        """Where a reference pointed before the document was bundled (see bundle.py)
+        """
+        return self.provenance.get(ref, ref)
 
+    def reference_typename(self, ref: str) -> str:
+        return self.original_reference(ref).split("/")[-1]
+
+    def load_fragment(self, jsonpointer: str) -> typing.Dict[str, typing.Any]:
+        try:
+            return self._fragments[jsonpointer]
+        except KeyError:
+            pass
+
+        file_path, localjsonpointer = split_reference(self.file_path, jsonpointer)
+
+        document = self._load_file(file_path)
         for part in localjsonpointer.split("/"):
             if part:
-                document = document[part]
+                document = document[unescape_jsonpointer(part)]
+        self._fragments[jsonpointer] = document
         return document
 
 
+class DocumentSet:
+    """A set of documents (typically all the versions of the specs for a service)
+    whose definitions are deduplicated by content across the documents.
+    """
+
+    def __init__(self, documents: typing.List[Document]):
+        self.documents = documents
+
+        if len(documents) > 1:
+            root = os.path.commonpath(
+                [os.path.dirname(document.file_path) for document in documents]
+            )
+        elif documents:
+            root = os.path.dirname(documents[0].file_path)
+        else:
+            root = ""
+        self.labels = [
+            os.path.relpath(document.file_path, root).replace(os.sep, "/")
+            for document in documents
+        ]
+
+        self._labels = {
+            document.file_path: label for document, label in zip(documents, self.labels)
+        }
+
+        self.definitions: typing.List[Definition] = []
+        self._hashes = self._content_hashes(documents)
+        self._variants: typing.Dict[str, int] = {}
+        self._typename_variants: typing.Dict[typing.Tuple[str, str], int] = {}
+        variantcounts: typing.Dict[str, int] = collections.defaultdict(int)
+        for document in documents:
+            for definition in document.definitions:
+                content_hash = self.content_hash(definition)
+                if content_hash not in self._variants:
+                    self._variants[content_hash] = variantcounts[definition.typename]
+                    variantcounts[definition.typename] += 1
+                    self.definitions.append(definition)
+                self._typename_variants[
+                    (document.file_path, definition.typename)
+                ] = self._variants[content_hash]
+
+        self._resource_hashes = {
+            self.content_hash(definition)
+            for document in documents
+            for definition in document.resourcedefinitions
+        }
+
+    @property
+    def diagnostics(self) -> Diagnostics:
+        diagnostics = Diagnostics(file_path="")
+        for document in self.documents:
+            diagnostics.extend(document.diagnostics)
+        return diagnostics
+
+    @classmethod
+    def from_files(
+        cls,
+        file_paths: typing.Iterable[str],
+        *,
+        max_property_depth=Document.DEFAULT_MAX_PROPERTY_DEPTH,
+    ) -> "DocumentSet":
+        files: typing.Dict[str, typing.Any] = {}
+        return cls(
+            [
+                Document(
+                    file_path, max_property_depth=max_property_depth, files=files
+                )
+                for file_path in file_paths
+            ]
+        )
+
+    @staticmethod
+    def _definition_key(definition: Definition) -> typing.Tuple[str, str]:
+        # The same (file, local json pointer) form as split_reference returns for a
+        # $ref, so that references can be matched up with definitions
+        return (
+            definition.document.file_path,
+            "definitions/" + escape_jsonpointer(definition.typename),
+        )
+
+    @classmethod
+    def _content_hashes(
+        cls, documents: typing.List[Document]
+    ) -> typing.Dict[typing.Tuple[str, str], str]:
+        """Content hash of every definition in the documents, by _definition_key.
+
+        A $ref counts as the content of its target, not as its text, so definitions
+        that refer to models which differ between the documents differ as well.
+        References can be cyclic, so the hashes are refined step by step instead:
+        starting from the content of each fragment, every hash is combined with the
+        hashes of the fragments it refers to until that no longer tells any more
+        fragments apart.
+        """
+        # (file, local json pointer) -> (hash, [($ref, (file, local json pointer))])
+        nodes: typing.Dict[typing.Tuple[str, str], typing.Tuple[str, list]] = {}
+        pending = [
+            (cls._definition_key(definition), document, definition.raw_jsonfragment)
+            for document in documents
+            for definition in document.definitions
+        ]
+        while pending:
+            key, document, fragment = pending.pop()
+            if key in nodes:
+                continue
+            references = []
+            stack = [fragment]
+            while stack:
+                node = stack.pop()
+                if isinstance(node, list):
+                    stack.extend(node)
+                elif isinstance(node, collections.abc.Mapping):
+                    ref = node.get("$ref")
+                    if isinstance(ref, str):
+                        references.append((ref, split_reference(key[0], ref)))
+                    stack.extend(node.values())
+
+            for _, target in references:
+                if target not in nodes:
+                    try:
+                        targetfragment = document.load_fragment(
+                            f"{target[0]}#/{target[1]}"
+                        )
+                    except (KeyError, OSError):
+                        # Unresolvable - only the text of the $ref counts
+                        continue
+                    pending.append((target, document, targetfragment))
+
+            typename = unescape_jsonpointer(key[1].split("/")[-1])
+            nodes[key] = (cls._digest([typename, fragment]), references)
+
+        hashes = {key: content for key, (content, _) in nodes.items()}
+        groups = len(set(hashes.values()))
+        while True:
+            hashes = {
+                key: cls._digest(
+                    [
+                        hashes[key],
+                        sorted(
+                            [ref, hashes.get(target)] for ref, target in references
+                        ),
+                    ]
+                )
+                for key, (_, references) in nodes.items()
+            }
+            refinedgroups = len(set(hashes.values()))
+            if refinedgroups == groups:
+                return hashes
+            groups = refinedgroups
+
+    @staticmethod
+    def _digest(content) -> str:
+        return hashlib.sha256(
+            json.dumps(content, sort_keys=True, default=dict).encode("utf8")
+        ).hexdigest()
+
+    def content_hash(self, definition: Definition) -> str:
+        return self._hashes[self._definition_key(definition)]
+
+    def definition_variant(self, definition: Definition) -> int:
+        """0 for the first distinct definition with a given name, 1 for the second
+        one (with the same name but different content) and so on.
+        """
+        return self._variants[self.content_hash(definition)]
+
+    def typename_variant(self, document: Document, typename: str) -> int:
+        """The variant of the model that typename refers to in document (0 if it is
+        not defined in the document)
+        """
+        return self._typename_variants.get((document.file_path, typename), 0)
+
+    def label(self, document: Document) -> str:
+        return self._labels[document.file_path]
+
+    @property
+    def resourcedefinitions(self):
+        return [
+            definition
+            for definition in self.definitions
+            if self.content_hash(definition) in self._resource_hashes
+        ]
+
+    @property
+    def supportdefinitions(self):
+        return [
+            definition
+            for definition in self.definitions
+            if self.content_hash(definition) not in self._resource_hashes
+        ]
+
+
+def load_manifest(file_path: str, tag: typing.Optional[str] = None) -> typing.List[str]:
+    """The input files for a tag in an AutoRest style readme.md. Without a tag, the
+    default tag from the readme is used.
+    """
+    with open(file_path, mode="r", encoding="utf8") as f:
+        text = f.read()
+
+    blocks = [
+        (match.group("condition").strip(), match.group("body"))
+        for match in re.finditer(
+            r"^```\s*yaml(?P<condition>[^\n]*)\n(?P<body>.*?)^```",
+            text,
+            flags=re.MULTILINE | re.DOTALL,
+        )
+    ]
+
+    if tag is None:
+        for condition, body in blocks:
+            match = re.search(r"^tag:\s*(\S+)", body, flags=re.MULTILINE)
+            if not condition and match:
+                tag = match.group(1).strip("'\"")
+                break
+
+    input_files = []
+    for condition, body in blocks:
+        if condition:
+            match = re.fullmatch(
+                r"\$\(tag\)\s*==\s*['\"](?P<tag>[^'\"]+)['\"]", condition
+            )
+            if not match or match.group("tag") != tag:
+                continue
+        in_input_files = False
+        for line in body.splitlines():
+            match = re.match(r"^input-file:\s*(?P<value>\S*)", line)
+            if match:
+                in_input_files = not match.group("value")
+                if match.group("value"):
+                    input_files.append(match.group("value"))
+                continue
+            match = re.match(r"^\s*-\s*(?P<value>\S+)", line)
+            if in_input_files and match:
+                input_files.append(match.group("value"))
+            elif line.strip():
+                in_input_files = False
+
+    if not input_files:
+        raise ValueError(f"No input files for tag {tag!r} in {file_path}")
+    return [
+        os.path.join(os.path.dirname(os.path.abspath(file_path)), input_file)
+        for input_file in input_files
+    ]
+
+
+def write_diagnostics(diagnostics: Diagnostics, file_path: typing.Optional[str] = None):
+    """Write the diagnostics report as json to file_path, or to standard error if
+    there are any diagnostics and no file_path is given.
+    """
+    if file_path:
+        with open(file_path, mode="w", encoding="utf8") as f:
+            json.dump(diagnostics.report(), f, indent=2)
+    elif len(diagnostics):
+        json.dump(diagnostics.report(), sys.stderr, indent=2)
+        sys.stderr.write("\n")
+
+
+def split_reference(base_file_path: str, ref: str) -> typing.Tuple[str, str]:
+    """Split a $ref into the absolute path of the file it points into and the local
+    json pointer within that file. Relative file paths are relative to the file the
+    reference appears in.
+    """
+    filepathjsonpointer, _, localjsonpointer = ref.partition("#")
+
+    if filepathjsonpointer in (".", "", "./"):
+        file_path = base_file_path
+    elif not os.path.isabs(filepathjsonpointer):
+        file_path = os.path.join(os.path.dirname(base_file_path), filepathjsonpointer)
+    else:
+        file_path = filepathjsonpointer
+
+    return os.path.normpath(file_path), localjsonpointer.lstrip("/")
+
+
+def escape_jsonpointer(part: str) -> str:
+    return part.replace("~", "~0").replace("/", "~1")
+
+
+def unescape_jsonpointer(part: str) -> str:
+    return part.replace("~1", "/").replace("~0", "~")
+
+
 def cli():
     import argparse
 
+    import snapshot
+
     DISPLAY_ALL = ("paths", "operations")
     parser = argparse.ArgumentParser("swopenapi")
     parser.add_argument(type=str, dest="filename")
     parser.add_argument("--debug", action="store_true", dest="debug", default=False)
+    parser.add_argument(
+        "--max-property-depth",
+        type=int,
+        dest="max_property_depth",
+        default=Document.DEFAULT_MAX_PROPERTY_DEPTH,
+    )
+    parser.add_argument(
+        "--snapshot-dir",
+        type=str,
+        dest="snapshot_dir",
+        default=None,
+        help="Directory to load built documents from and save them to",
+    )
+    parser.add_argument(
+        "--diagnostics-file",
+        type=str,
+        dest="diagnostics_file",
+        default=None,
+        help="Write the diagnostics report to this file instead of standard error",
+    )
     parser.add_argument(
         "--display",
         dest="displaytype",
@@ -507,7 +1094,11 @@ def cli():
 
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARN)
 
-    doc = Document(args.filename)
+    doc = snapshot.load_or_build(
+        args.filename,
+        args.snapshot_dir,
+        max_property_depth=args.max_property_depth,
+    )
     for path in doc.paths:
         if "paths" in args.displaytype:
             print(path.name)
@@ -540,6 +1131,8 @@ def cli():
                 )
                 print(f"\t{operation.verb} {operation.name}({parameters})")
 
+    write_diagnostics(doc.diagnostics, args.diagnostics_file)
+
 
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,312 @@
+import bisect
+import collections
+import json
+import logging
+import typing
+
+import openapi
+from apiserializer import (
+    model_definition_id,
+    operation_definition_id,
+    path_definition_id,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SearchHit(typing.NamedTuple):
+    kind: str
+    name: str
+    jsonpointer: str
+    definition_id: typing.Optional[str]
+    context: typing.Optional[str]
+
+
+KINDS = ("operation", "path", "definition", "property", "parameter")
+
+
+def ngrams(value: str, n: int = 3) -> typing.Set[str]:
+    value = value.lower()
+    return {value[i : i + n] for i in range(len(value) - n + 1)}
+
+
+def _all_ngrams(value: str) -> typing.Set[str]:
+    """Unigrams, bigrams and trigrams of value"""
+    return ngrams(value, 1) | ngrams(value, 2) | ngrams(value, 3)
+
+
+# Placeholders used by openapi for responses without a body and schemas that are
+# not a reference to a model
+PSEUDO_TYPENAMES = ("void", "?")
+
+
+def _referenced_typename(typename: str) -> str:
+    return typename[1:-1] if typename.startswith("[") else typename
+
+
+class SearchIndex:
+    """In-memory index over the names of operations, paths, definitions, properties
+    and parameters in a document.
+
+    Supports prefix lookup (over a sorted list of lowercased names) and substring
+    lookup (over n-gram posting lists), as well as finding the operations that
+    take or return a given model. Queries of up to three characters are answered
+    directly from the postings of the matching unigram, bigram or trigram; longer
+    queries intersect the postings of their trigrams.
+    """
+
+    VERSION = 2
+
+    def __init__(
+        self,
+        hits: typing.List[SearchHit],
+        *,
+        usages: typing.Optional[typing.Dict[str, typing.List[int]]] = None,
+        sortedkeys: typing.Optional[typing.List[typing.Tuple[str, int]]] = None,
+        postings: typing.Optional[typing.Dict[str, typing.List[int]]] = None,
+    ):
+        self.hits = hits
+        self.usages = usages or {}
+
+        if sortedkeys is None:
+            sortedkeys = sorted((hit.name.lower(), i) for i, hit in enumerate(hits))
+        self._sortedkeys = sortedkeys
+        self._lowernames = [hit.name.lower() for hit in hits]
+        self._sortednames = [name for name, _ in sortedkeys]
+
+        if postings is None:
+            buildpostings = collections.defaultdict(list)
+            for i, hit in enumerate(hits):
+                for ngram in _all_ngrams(hit.name):
+                    buildpostings[ngram].append(i)
+            postings = dict(buildpostings)
+        # Sorted lists answer short queries as-is, sets are intersected for longer
+        # ones.
+        self._postings = postings
+        self._trigramsets = {
+            ngram: set(ids) for ngram, ids in postings.items() if len(ngram) == 3
+        }
+
+    @classmethod
+    def from_document(cls, document: openapi.Document) -> "SearchIndex":
+        hits: typing.List[SearchHit] = []
+        usages = collections.defaultdict(list)
+
+        for path in document.paths:
+            pathid = path_definition_id(path)
+            hits.append(SearchHit("path", path.name, path.jsonpointer, pathid, None))
+            for operation in path.operations:
+                operationindex = len(hits)
+                operationid = operation_definition_id(operation)
+                hits.append(
+                    SearchHit(
+                        "operation",
+                        operation.name,
+                        operation.jsonpointer,
+                        operationid,
+                        path.name,
+                    )
+                )
+                parameters = (
+                    operation.path_parameters
+                    + operation.query_parameters
+                    + operation.header_parameters
+                )
+                if operation.body_parameter:
+                    parameters = parameters + [operation.body_parameter]
+                for parameter in parameters:
+                    hits.append(
+                        SearchHit(
+                            "parameter",
+                            parameter.jsonfragment.get("name", ""),
+                            parameter.jsonpointer,
+                            operationid,
+                            operation.name,
+                        )
+                    )
+
+                used = set()
+                if operation.body_parameter:
+                    used.add(operation.body_parameter.typename)
+                used.add(operation.return_value.typename)
+                used.update(exception.typename for exception in operation.exceptions)
+                for usedtypename in used:
+                    usedtypename = _referenced_typename(usedtypename)
+                    if usedtypename not in PSEUDO_TYPENAMES:
+                        usages[usedtypename].append(operationindex)
+
+        for definition in document.definitions:
+            definitionid = model_definition_id(definition)
+            hits.append(
+                SearchHit(
+                    "definition",
+                    definition.typename,
+                    definition.jsonpointer,
+                    definitionid,
+                    None,
+                )
+            )
+            stack = list(reversed(definition.properties))
+            while stack:
+                modelproperty = stack.pop()
+                hits.append(
+                    SearchHit(
+                        "property",
+                        modelproperty.name,
+                        modelproperty.jsonpointer,
+                        definitionid,
+                        definition.typename,
+                    )
+                )
+                stack.extend(reversed(modelproperty.properties))
+
+        return cls(hits, usages=dict(usages))
+
+    def prefix(
+        self, value: str, *, kinds: typing.Optional[typing.Iterable[str]] = None
+    ) -> typing.List[SearchHit]:
+        """All hits whose name starts with value (case insensitive)
+        """
+        value = value.lower()
+        start = bisect.bisect_left(self._sortednames, value)
+        end = bisect.bisect_left(self._sortednames, value + "\uffff", lo=start)
+        return self._select(
+            sorted(index for _, index in self._sortedkeys[start:end]), kinds
+        )
+
+    def search(
+        self, value: str, *, kinds: typing.Optional[typing.Iterable[str]] = None
+    ) -> typing.List[SearchHit]:
+        """All hits whose name contains value (case insensitive)
+        """
+        value = value.lower()
+        if not value:
+            return self._select(range(len(self.hits)), kinds)
+        if len(value) <= 3:
+            return self._select(self._postings.get(value, []), kinds)
+
+        # Intersecting the few rarest trigrams narrows the candidates down about
+        # as well as intersecting all of them, for a fraction of the cost. The
+        # candidates are checked against the full value anyway.
+        postings = sorted(
+            (self._trigramsets.get(trigram, set()) for trigram in ngrams(value)),
+            key=len,
+        )[:3]
+        candidates = postings[0].intersection(*postings[1:])
+        return self._select(
+            sorted(index for index in candidates if value in self._lowernames[index]),
+            kinds,
+        )
+
+    def operations_using(self, typename: str) -> typing.List[SearchHit]:
+        """Operations that take (request body) or return (response body) the model
+        """
+        return [self.hits[index] for index in self.usages.get(typename, [])]
+
+    def _select(self, indices, kinds) -> typing.List[SearchHit]:
+        hits = [self.hits[index] for index in indices]
+        if kinds:
+            kinds = set(kinds)
+            hits = [hit for hit in hits if hit.kind in kinds]
+        return hits
+
+    def to_dict(self) -> typing.Dict[str, typing.Any]:
+        return {
+            "Version": self.VERSION,
+            "Hits": [list(hit) for hit in self.hits],
+            "Usages": self.usages,
+            "SortedKeys": [list(key) for key in self._sortedkeys],
+            "Ngrams": self._postings,
+        }
+
+    @classmethod
+    def from_dict(cls, data: typing.Dict[str, typing.Any]) -> "SearchIndex":
+        if data.get("Version") != cls.VERSION:
+            raise ValueError(
+                f"Unsupported search index version {data.get('Version')!r}"
+            )
+        return cls(
+            [SearchHit(*hit) for hit in data["Hits"]],
+            usages=data["Usages"],
+            sortedkeys=[tuple(key) for key in data["SortedKeys"]],
+            postings=data["Ngrams"],
+        )
+
+
+def cli():
+    import argparse
+
+    parser = argparse.ArgumentParser("searchindex")
+    parser.add_argument("--debug", action="store_true", dest="debug", default=False)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    buildparser = subparsers.add_parser("build", help="Build and save an index")
+    buildparser.add_argument(type=str, dest="filename")
+    buildparser.add_argument("-o", "--output", type=str, dest="output", default=None)
+
+    queryparser = subparsers.add_parser("query", help="Look up names in an index")
+    queryparser.add_argument(
+        type=str,
+        dest="filename",
+        nargs="?",
+        default=None,
+        help="openapi document to build the index from (unless --index is given)",
+    )
+    queryparser.add_argument(type=str, dest="term")
+    queryparser.add_argument(
+        "--index",
+        type=str,
+        dest="index",
+        default=None,
+        help="Index saved by 'build' to query instead of an openapi document",
+    )
+    queryparser.add_argument(
+        "--mode", choices=("prefix", "substring", "uses"), default="substring"
+    )
+    queryparser.add_argument(
+        "--kind",
+        choices=KINDS,
+        dest="kinds",
+        action="append",
+        help="Only return hits of this kind (can be repeated, not with --mode uses)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARN)
+
+    if args.command == "build":
+        index = SearchIndex.from_document(openapi.Document(args.filename))
+        out = json.dumps(index.to_dict())
+        if args.output:
+            with open(args.output, mode="w", encoding="utf8") as f:
+                f.write(out)
+        else:
+            print(out)
+        return
+
+    if bool(args.index) == bool(args.filename):
+        queryparser.error("give exactly one of an openapi document or --index")
+    if args.mode == "uses" and args.kinds:
+        queryparser.error("--kind cannot be combined with --mode uses")
+
+    if args.index:
+        with open(args.index, mode="r", encoding="utf8") as f:
+            index = SearchIndex.from_dict(json.load(f))
+    else:
+        index = SearchIndex.from_document(openapi.Document(args.filename))
+
+    if args.mode == "prefix":
+        hits = index.prefix(args.term, kinds=args.kinds)
+    elif args.mode == "uses":
+        hits = index.operations_using(args.term)
+    else:
+        hits = index.search(args.term, kinds=args.kinds)
+    for hit in hits:
+        print(
+            f"{hit.kind}\t{hit.name}\t{hit.jsonpointer}\t{hit.definition_id}"
+            + (f"\t{hit.context}" if hit.context else "")
+        )
+
+
+if __name__ == "__main__":
+    cli()
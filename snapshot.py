@@ -0,0 +1,163 @@
+"""Save and load built openapi.Document models.
+
+A snapshot is a small header (format version, build options and the sha256 of
+every source file that was read to build the document) followed by the pickled
+document. Loading a snapshot checks the header against the current source files
+before unpickling anything, and rejects the snapshot if any of them has changed.
+
+Snapshots are pickles - only load snapshots that you created yourself.
+"""
+import gc
+import hashlib
+import logging
+import os
+import os.path
+import pickle
+import tempfile
+import typing
+
+import openapi
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SWAPIVIEW-SNAPSHOT\n"
+
+# Bump whenever the shape of the openapi model changes
+VERSION = 6
+
+
+def file_hash(file_path: str) -> str:
+    with open(file_path, mode="rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def _options(max_property_depth: int) -> typing.Dict[str, typing.Any]:
+    return {"max_property_depth": max_property_depth}
+
+
+def snapshot_path(snapshot_dir: str, file_path: str) -> str:
+    """Location of the snapshot for the given openapi document in snapshot_dir
+    """
+    file_path = os.path.abspath(file_path)
+    key = hashlib.sha256(file_path.encode("utf8")).hexdigest()[:16]
+    return os.path.join(
+        snapshot_dir, f"{os.path.basename(file_path)}.{key}.snapshot"
+    )
+
+
+def save(document: openapi.Document, path: str) -> bool:
+    """Write the snapshot for the document to path. Returns False (and leaves any
+    existing snapshot at path alone) if the document cannot be pickled.
+    """
+    header = {
+        "version": VERSION,
+        "file_path": document.file_path,
+        "options": _options(document.max_property_depth),
+        "sources": {
+            file_path: file_hash(file_path) for file_path in document.source_files
+        },
+    }
+    # Write to a temporary file in the same directory first, so that a concurrent
+    # reader never sees a partially written snapshot, and remove it again if
+    # anything goes wrong.
+    fd, temporary_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=os.path.basename(path), suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, mode="wb") as f:
+            f.write(MAGIC)
+            pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(document, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+    except RecursionError:
+        # Very deeply nested models are too deep for pickle. Not worth failing
+        # the run for - the document is just built from source every time.
+        os.remove(temporary_path)
+        logger.info("Not writing snapshot %s: document is nested too deeply", path)
+        return False
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+    return True
+
+
+def load(
+    path: str,
+    file_path: str,
+    *,
+    max_property_depth: int = openapi.Document.DEFAULT_MAX_PROPERTY_DEPTH,
+) -> typing.Optional[openapi.Document]:
+    """Load the snapshot at path, or return None if it is missing, unreadable, was
+    written by a different version, was built from different options or if any of
+    the source files have changed since it was written.
+    """
+    try:
+        return _load(path, file_path, max_property_depth=max_property_depth)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        # A snapshot is only a cache: a truncated or otherwise corrupt one is
+        # treated like a stale one and rebuilt.
+        logger.info("Ignoring snapshot %s: %s", path, e)
+        return None
+
+
+def _load(
+    path: str, file_path: str, *, max_property_depth: int
+) -> typing.Optional[openapi.Document]:
+    with open(path, mode="rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            logger.info("Ignoring snapshot %s: not a snapshot", path)
+            return None
+        header = pickle.load(f)
+        if header.get("version") != VERSION:
+            logger.info("Ignoring snapshot %s: version %s", path, header.get("version"))
+            return None
+        if header["file_path"] != os.path.abspath(file_path) or header[
+            "options"
+        ] != _options(max_property_depth):
+            logger.info("Ignoring snapshot %s: built with different options", path)
+            return None
+        for source_path, digest in header["sources"].items():
+            try:
+                current = file_hash(source_path)
+            except OSError:
+                current = None
+            if current != digest:
+                logger.info("Ignoring snapshot %s: %s has changed", path, source_path)
+                return None
+
+        # Unpickling creates a lot of objects and none of them are garbage, so the
+        # cyclic garbage collector only slows it down (by more than half).
+        gcenabled = gc.isenabled()
+        gc.disable()
+        try:
+            return pickle.load(f)
+        finally:
+            if gcenabled:
+                gc.enable()
+
+
+def load_or_build(
+    file_path: str,
+    snapshot_dir: typing.Optional[str],
+    *,
+    max_property_depth: int = openapi.Document.DEFAULT_MAX_PROPERTY_DEPTH,
+) -> openapi.Document:
+    """Load the document from a snapshot in snapshot_dir if there is an up to date
+    one, otherwise build it from source and (re)write the snapshot.
+    """
+    if not snapshot_dir:
+        return openapi.Document(file_path, max_property_depth=max_property_depth)
+
+    path = snapshot_path(snapshot_dir, file_path)
+    document = load(path, file_path, max_property_depth=max_property_depth)
+    if document is not None:
+        logger.debug("Loaded %s from snapshot %s", file_path, path)
+        return document
+
+    document = openapi.Document(file_path, max_property_depth=max_property_depth)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    if save(document, path):
+        logger.debug("Wrote snapshot %s for %s", path, file_path)
+    return document